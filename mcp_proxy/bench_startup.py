@@ -0,0 +1,134 @@
+"""Cold start benchmark for the proxy.
+
+Reports the time to `import mcp_proxy`, which transport modules that import
+pulls in, and the time from spawning `main.py stdio` to the first response
+to an initialize request. Transport modules listed as loaded come from the
+mcp SDK's own package imports, not from the proxy.
+
+    python bench_startup.py [--runs 5] [--conf-dir DIR]
+
+Without --conf-dir the proxy runs in a temporary directory with no upstream
+servers, so only the proxy itself is measured.
+"""
+import argparse
+import json
+import os
+import queue
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PROXY_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TRANSPORT_MODULES = [
+    'uvicorn',
+    'starlette',
+    'sse_starlette',
+    'httpx',
+    'mcp.server.sse',
+    'mcp.server.streamable_http_manager',
+    'mcp.client.sse',
+    'mcp.client.streamable_http',
+    'mcp.server.fastmcp',
+]
+
+IMPORT_SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+import mcp_proxy
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    'seconds': elapsed,
+    'loaded': [m for m in {TRANSPORT_MODULES!r} if m in sys.modules],
+}}))
+"""
+
+INITIALIZE = {
+    'jsonrpc': '2.0',
+    'id': 1,
+    'method': 'initialize',
+    'params': {
+        'protocolVersion': '2025-03-26',
+        'capabilities': {},
+        'clientInfo': {'name': 'bench_startup', 'version': '0'},
+    },
+}
+
+
+def measure_import():
+    out = subprocess.run(
+        [sys.executable, '-c', IMPORT_SCRIPT],
+        cwd=PROXY_DIR, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def read_lines(stream, lines):
+    for line in stream:
+        lines.put(line)
+    lines.put('')
+
+
+def measure_first_response(conf_dir, timeout):
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(PROXY_DIR, 'main.py'), 'stdio'],
+        cwd=conf_dir, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    )
+    # readline blocks, read on a thread so the timeout holds even if the proxy never writes
+    lines = queue.Queue()
+    threading.Thread(target=read_lines, args=(proc.stdout, lines), daemon=True).start()
+    try:
+        proc.stdin.write(json.dumps(INITIALIZE) + '\n')
+        proc.stdin.flush()
+        while True:
+            remaining = timeout - (time.perf_counter() - start)
+            try:
+                line = lines.get(timeout=max(remaining, 0))
+            except queue.Empty:
+                raise RuntimeError(f'no initialize response from the proxy within {timeout}s') from None
+            if not line:
+                break
+            try:
+                message = json.loads(line)
+            except ValueError:
+                # not a JSON-RPC line
+                continue
+            if isinstance(message, dict) and message.get('id') == 1:
+                return time.perf_counter() - start
+        raise RuntimeError('no initialize response from the proxy')
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def summary(samples):
+    return f'median={statistics.median(samples) * 1000:.1f}ms min={min(samples) * 1000:.1f}ms'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--conf-dir', help='directory holding the mcp_server_conf.json to start with')
+    parser.add_argument('--timeout', type=float, default=30)
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    print(f'import mcp_proxy: {summary([i["seconds"] for i in imports])}')
+    print(f'transport modules loaded by the import: {imports[-1]["loaded"] or "none"}')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conf_dir = args.conf_dir
+        if conf_dir is None:
+            conf_dir = tmp
+            with open(os.path.join(tmp, 'mcp_server_conf.json'), 'w') as f:
+                json.dump({'mcp_server': []}, f)
+        first_responses = [measure_first_response(conf_dir, args.timeout) for _ in range(args.runs)]
+    print(f'stdio time to first response: {summary(first_responses)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+import asyncio
+import json
+from collections import defaultdict
+from typing import Any, Callable, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+INVALID_REQUEST = -32600
+INTERNAL_ERROR = -32603
+
+
+def jsonrpc_error(message_id: Any, code: int, message: str) -> dict:
+    return {'jsonrpc': '2.0', 'id': message_id, 'error': {'code': code, 'message': message}}
+
+
+class JSONRPCBatchApp:
+    """ASGI wrapper that accepts JSON-RPC batch arrays in front of an MCP endpoint.
+
+    Every batch element is replayed through the wrapped app as a standalone
+    request, so it goes through the normal session handling and routing.
+    When `route_key` is given, elements bound for the same upstream share one
+    concurrency limit. That only makes sense where the wrapped app answers
+    inline (streamable-http); the SSE message endpoint just queues each
+    element and answers on the SSE stream, so it is wrapped without grouping.
+    Inline responses are returned as one JSON array, or streamed as SSE
+    events as each one completes when `stream` is on and the client accepts
+    it. Anything that is not a batch is passed through untouched.
+    """
+
+    def __init__(
+            self,
+            app: ASGIApp,
+            route_key: Optional[Callable[[dict], str]] = None,
+            max_batch_size: int = 32,
+            upstream_concurrency: int = 8,
+            stream: bool = False,
+    ):
+        self.app = app
+        self.route_key = route_key
+        self.max_batch_size = max_batch_size
+        self.upstream_concurrency = upstream_concurrency
+        self.stream = stream
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or scope['method'] != 'POST':
+            await self.app(scope, receive, send)
+            return
+
+        body = await self._read_body(receive)
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = None
+        if not isinstance(payload, list):
+            await self.app(scope, self._replay_receive(body, receive), send)
+            return
+
+        if not payload:
+            await self._send_json(send, 400, jsonrpc_error(None, INVALID_REQUEST, 'Empty batch'))
+            return
+        if len(payload) > self.max_batch_size:
+            await self._send_json(send, 400, jsonrpc_error(
+                None, INVALID_REQUEST, f'Batch size {len(payload)} exceeds limit {self.max_batch_size}'))
+            return
+
+        print(f'in JSONRPCBatchApp, batch size={len(payload)}, path={scope["path"]}')
+        await self._handle_batch(scope, payload, send)
+
+    async def _handle_batch(self, scope: Scope, payload: list, send: Send) -> None:
+        groups = defaultdict(list)
+        for index, message in enumerate(payload):
+            key = self.route_key(message) if self.route_key and isinstance(message, dict) else ''
+            groups[key].append(index)
+        limits = {key: asyncio.Semaphore(self.upstream_concurrency) for key in groups}
+
+        finished = asyncio.Event()
+        headers = {}
+
+        async def dispatch(key: str, message: Any) -> dict | None:
+            async with limits[key]:
+                response, sub_headers = await self._dispatch_one(scope, message, finished)
+            if b'mcp-session-id' in sub_headers:
+                headers[b'mcp-session-id'] = sub_headers[b'mcp-session-id']
+            return response
+
+        # launch same-upstream calls next to each other, preserving the original order for the reply
+        tasks = {}
+        for key, indexes in groups.items():
+            for index in indexes:
+                tasks[index] = asyncio.ensure_future(dispatch(key, payload[index]))
+
+        try:
+            if self.stream and self._accepts_event_stream(scope):
+                await self._stream_responses(send, list(tasks.values()), headers)
+            else:
+                responses = await asyncio.gather(*(tasks[index] for index in sorted(tasks)))
+                responses = [response for response in responses if response is not None]
+                if not responses:
+                    await self._send_empty(send, 202, headers)
+                else:
+                    await self._send_json(send, 200, responses, headers)
+        finally:
+            finished.set()
+            for task in tasks.values():
+                task.cancel()
+
+    async def _stream_responses(self, send: Send, tasks: list, headers: dict) -> None:
+        started = False
+        for next_done in asyncio.as_completed(tasks):
+            response = await next_done
+            if response is None:
+                continue
+            if not started:
+                await send({
+                    'type': 'http.response.start',
+                    'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                                *headers.items()],
+                })
+                started = True
+            data = json.dumps(response, separators=(',', ':'))
+            await send({
+                'type': 'http.response.body',
+                'body': f'event: message\ndata: {data}\n\n'.encode(),
+                'more_body': True,
+            })
+        if not started:
+            await self._send_empty(send, 202, headers)
+            return
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    async def _dispatch_one(self, scope: Scope, message: Any, finished: asyncio.Event) -> tuple[dict | None, dict]:
+        if not isinstance(message, dict):
+            return jsonrpc_error(None, INVALID_REQUEST, 'Invalid Request'), {}
+        message_id = message.get('id')
+        is_response = 'method' not in message and ('result' in message or 'error' in message)
+        if not is_response and not isinstance(message.get('method'), str):
+            # neither a request, a notification nor a response to a server request
+            return jsonrpc_error(message_id, INVALID_REQUEST, 'Invalid Request'), {}
+        is_request = 'id' in message and not is_response
+
+        body = json.dumps(message).encode()
+        sub_scope = dict(scope)
+        sub_scope['headers'] = [
+            (k, v) for k, v in scope['headers'] if k.lower() != b'content-length'
+        ] + [(b'content-length', str(len(body)).encode())]
+
+        sent = False
+
+        async def sub_receive() -> Message:
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+
+        status = 500
+        sub_headers = {}
+        chunks = []
+
+        async def sub_send(sub_message: Message) -> None:
+            nonlocal status, sub_headers
+            if sub_message['type'] == 'http.response.start':
+                status = sub_message['status']
+                sub_headers = {k.lower(): v for k, v in sub_message.get('headers', [])}
+            elif sub_message['type'] == 'http.response.body':
+                chunks.append(sub_message.get('body', b''))
+
+        try:
+            await self.app(sub_scope, sub_receive, sub_send)
+        except Exception as e:  # noqa: BLE001
+            print(f'in JSONRPCBatchApp, dispatch error={e}')
+            return (jsonrpc_error(message_id, INTERNAL_ERROR, str(e)) if is_request else None), sub_headers
+
+        response = self._parse_response(b''.join(chunks), sub_headers)
+        if response is None and is_request and status >= 400:
+            response = jsonrpc_error(message_id, INTERNAL_ERROR, f'HTTP {status}')
+        if isinstance(response, dict) and 'error' in response and is_request:
+            # transport-level errors carry a placeholder id, tie them back to the element
+            response['id'] = message_id
+        return (response if is_request else None), sub_headers
+
+    @staticmethod
+    def _parse_response(body: bytes, headers: dict) -> dict | None:
+        if not body:
+            return None
+        content_type = headers.get(b'content-type', b'').decode()
+        try:
+            if content_type.startswith('text/event-stream'):
+                for line in body.decode().splitlines():
+                    if line.startswith('data:'):
+                        return json.loads(line[5:].strip())
+                return None
+            if content_type.startswith('application/json'):
+                return json.loads(body)
+        except ValueError:
+            return None
+        return None
+
+    @staticmethod
+    def _accepts_event_stream(scope: Scope) -> bool:
+        for k, v in scope['headers']:
+            if k.lower() == b'accept' and b'text/event-stream' in v:
+                return True
+        return False
+
+    @staticmethod
+    async def _read_body(receive: Receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] != 'http.request':
+                break
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        return b''.join(chunks)
+
+    @staticmethod
+    def _replay_receive(body: bytes, receive: Receive) -> Receive:
+        sent = False
+
+        async def replay() -> Message:
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            return await receive()
+
+        return replay
+
+    @staticmethod
+    async def _send_json(send: Send, status: int, content: Any, headers: dict | None = None) -> None:
+        body = json.dumps(content, separators=(',', ':')).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                        *(headers or {}).items()],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    @staticmethod
+    async def _send_empty(send: Send, status: int, headers: dict | None = None) -> None:
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-length', b'0'), *(headers or {}).items()],
+        })
+        await send({'type': 'http.response.body', 'body': b''})
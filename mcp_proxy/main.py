@@ -5,11 +5,13 @@ from mcp_proxy import MCPProxy
 
 
 if __name__ == '__main__':
-    print(f'sys.argv={sys.argv}')
+    print(f'sys.argv={sys.argv}', file=sys.stderr)
     if len(sys.argv) < 2:
-        transport = 'stdio'
+        # fall back to frontend.transports in mcp_server_conf.json
+        transports = None
     else:
-        transport = sys.argv[1]
-    print(f'transport={transport}')
+        # e.g. `python main.py stdio,streamable-http`
+        transports = sys.argv[1].split(',')
+    print(f'transports={transports}', file=sys.stderr)
     proxy = MCPProxy()
-    asyncio.run(proxy.run(transport))
+    asyncio.run(proxy.run(transports))
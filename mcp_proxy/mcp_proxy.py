@@ -1,11 +1,14 @@
 import asyncio
 import json
+import sys
 from datetime import timedelta
+from io import TextIOWrapper
 from typing import Any
 import typing as t
 import contextlib
 from collections.abc import AsyncIterator
 
+import anyio
 from mcp import StdioServerParameters
 import mcp.types as types
 from mcp.shared.session import ProgressFnT
@@ -24,14 +27,22 @@ import uvicorn
 from stdio_proxy import STDIOProxy
 from sse_proxy import SSEProxy
 from streamable_http_proxy import StreamableHttpProxy
+from jsonrpc_batch import JSONRPCBatchApp
+from profiling import Profiler
+from payload_budget import PayloadBudget, PayloadReservation
 
 PROXY_NAME = "mpc-proxy-demo"
 
+FRONTEND_TRANSPORTS = ('stdio', 'sse', 'streamable-http')
+
 
 class MCPProxy:
     def __init__(self):
         self.server = {}
+        self.protocol_stdout = sys.stdout
         self.conf = self.get_server_conf()
+        self.profiler = Profiler(self.conf.get('profiling', {}))
+        self.payload_budget = PayloadBudget(self.conf.get('payload', {}))
 
     @staticmethod
     def get_server_conf():
@@ -67,30 +78,68 @@ class MCPProxy:
                     'proxy': proxy
                 }
 
-    async def run(self, transport):
-        async with contextlib.AsyncExitStack() as stack:
-            try:
-                await self.connect_mcp_server(stack)
-                print(f'========connect_mcp_server done========')
-                print(f'server({len(self.server)}): {self.server}')
-                server = await self.create_proxy_server()
-                print(f'========create_proxy_server done========')
-                if transport == 'stdio':
-                    print(f'========start stdio========')
-                    await self.run_stdio_proxy(server)
-                elif transport == 'sse' or transport == 'streamable-http':
-                    print(f'========start sse or streamable-http========')
-                    await self.run_sse_streamable_http_proxy(server, True)
-            except Exception as e:
-                print(f"proxy run exit with error={e}")
+    async def run(self, transports=None):
+        frontend_conf = self.conf.get('frontend', {})
+        transports = transports or frontend_conf.get('transports', ['stdio'])
+        unknown = [transport for transport in transports if transport not in FRONTEND_TRANSPORTS]
+        if unknown:
+            print(f'unknown frontend transports={unknown}', file=sys.stderr)
+        transports = [transport for transport in transports if transport in FRONTEND_TRANSPORTS]
+        if not transports:
+            raise ValueError(f'no valid frontend transport, expected some of {FRONTEND_TRANSPORTS}, got {unknown}')
+        if 'stdio' in transports:
+            # stdout is the stdio frontend's JSON-RPC channel, every diagnostic print goes to stderr
+            sys.stdout = sys.stderr
+        try:
+            async with contextlib.AsyncExitStack() as stack:
+                try:
+                    await self.connect_mcp_server(stack)
+                    print(f'========connect_mcp_server done========')
+                    print(f'server({len(self.server)}): {self.server}')
+                    server = await self.create_proxy_server()
+                    print(f'========create_proxy_server done========')
+                    async with self.profiler.run():
+                        await self.run_frontends(server, transports)
+                except Exception as e:
+                    print(f"proxy run exit with error={e}")
+                finally:
+                    self.payload_budget.cleanup()
+        finally:
+            sys.stdout = self.protocol_stdout
+
+    async def run_frontends(self, server: Server, transports: list[str]):
+        """Serve every requested frontend at once on top of the same proxy server.
+
+        SSE and streamable-http frontends configured on the same host and port
+        share one HTTP server.
+        """
+        frontend_conf = self.conf.get('frontend', {})
+        print(f'========start frontends {transports}========')
+        frontends = []
+        http_frontends = {}
+        for transport in transports:
+            if transport == 'stdio':
+                frontends.append(self.run_stdio_proxy(server))
+            else:
+                conf = frontend_conf.get(transport, {})
+                address = (conf.get('host', '127.0.0.1'), conf.get('port', 8082))
+                http_frontends.setdefault(address, []).append(transport)
+        for (host, port), http_transports in http_frontends.items():
+            # spilled payloads are served by the first HTTP frontend clients can reach by its bind address
+            if not self.payload_budget.spill_url and host not in ('0.0.0.0', '::', ''):
+                self.payload_budget.spill_url = f'http://{host}:{port}/payloads/'
+            frontends.append(self.run_sse_streamable_http_proxy(server, True, http_transports, host, port))
+        if self.payload_budget.enabled and http_frontends and not self.payload_budget.spill_url:
+            print('payload spilling disabled: HTTP frontends bind a wildcard host, set payload.spill_url')
+        await asyncio.gather(*frontends)
 
     async def create_proxy_server(self) -> Server[object]:  # noqa: C901, PLR0915
         """Create a server instance from a remote app."""
         capabilities = types.ServerCapabilities()
         for name, server in self.server.items():
             if server['proxy'].session:
-                response = await server['proxy'].session.initialize()
-                cap = response.capabilities
+                # reuse the handshake done in connect() instead of initializing again
+                cap = server['proxy'].initialize_result.capabilities
                 capabilities.prompts = capabilities.prompts or cap.prompts
                 capabilities.resources = capabilities.resources or cap.resources
                 capabilities.tools = capabilities.tools or cap.tools
@@ -100,11 +149,12 @@ class MCPProxy:
 
         async def _list_prompts(_: t.Any) -> types.ServerResult:  # noqa: ANN401
             print(f'in create_proxy_server _list_prompts')
-            result = await self.list_prompts()
+            with self.profiler.phase('aggregation'):
+                result = await self.list_prompts()
             print(f'in create_proxy_server _list_prompts, result={result}')
             return types.ServerResult(result)
 
-        app.request_handlers[types.ListPromptsRequest] = _list_prompts
+        app.request_handlers[types.ListPromptsRequest] = self.profiler.instrument('prompts/list', _list_prompts)
 
         async def _get_prompt(req: types.GetPromptRequest) -> types.ServerResult:
             print(f'in create_proxy_server _get_prompt')
@@ -112,43 +162,49 @@ class MCPProxy:
             print(f'in create_proxy_server _get_prompt, result={result}')
             return types.ServerResult(result)
 
-        app.request_handlers[types.GetPromptRequest] = _get_prompt
+        app.request_handlers[types.GetPromptRequest] = self.profiler.instrument('prompts/get', _get_prompt)
 
         async def _list_resources(_: t.Any) -> types.ServerResult:  # noqa: ANN401
             print("in handle _list_resources")
-            result = await self.list_resources()
+            with self.profiler.phase('aggregation'):
+                result = await self.list_resources()
             print(f"in handle _list_resources, result={result}")
             return types.ServerResult(result)
 
-        app.request_handlers[types.ListResourcesRequest] = _list_resources
+        app.request_handlers[types.ListResourcesRequest] = self.profiler.instrument('resources/list', _list_resources)
 
         async def _list_resource_templates(_: t.Any) -> types.ServerResult:  # noqa: ANN401
             print(f'in _list_resource_templates')
-            result = await self.list_resource_templates()
+            with self.profiler.phase('aggregation'):
+                result = await self.list_resource_templates()
             print(f'in _list_resource_templates, result={result}')
             return types.ServerResult(result)
 
-        app.request_handlers[types.ListResourceTemplatesRequest] = _list_resource_templates
+        app.request_handlers[types.ListResourceTemplatesRequest] = self.profiler.instrument('resources/templates/list', _list_resource_templates)
 
         async def _read_resource(req: types.ReadResourceRequest) -> types.ServerResult:
-            result = await self.read_resource(req.params.uri)
-            return types.ServerResult(result)
+            async with self.payload_budget.reserve() as reservation:
+                result = await self.read_resource(req.params.uri, reservation)
+                return reservation.release_after_dump(types.ServerResult(result))
 
-        app.request_handlers[types.ReadResourceRequest] = _read_resource
+        app.request_handlers[types.ReadResourceRequest] = self.profiler.instrument('resources/read', _read_resource)
 
         async def _list_tools(_: t.Any) -> types.ServerResult:  # noqa: ANN401
-            tools = await self.list_tools()
+            with self.profiler.phase('aggregation'):
+                tools = await self.list_tools()
             return types.ServerResult(tools)
 
-        app.request_handlers[types.ListToolsRequest] = _list_tools
+        app.request_handlers[types.ListToolsRequest] = self.profiler.instrument('tools/list', _list_tools)
 
         async def _call_tool(req: types.CallToolRequest) -> types.ServerResult:
             try:
-                result = await self.call_tool(
-                    req.params.name,
-                    (req.params.arguments or {}),
-                )
-                return types.ServerResult(result)
+                async with self.payload_budget.reserve() as reservation:
+                    result = await self.call_tool(
+                        req.params.name,
+                        (req.params.arguments or {}),
+                        reservation=reservation,
+                    )
+                    return reservation.release_after_dump(types.ServerResult(result))
             except Exception as e:  # noqa: BLE001
                 return types.ServerResult(
                     types.CallToolResult(
@@ -157,27 +213,37 @@ class MCPProxy:
                     ),
                 )
 
-        app.request_handlers[types.CallToolRequest] = _call_tool
+        app.request_handlers[types.CallToolRequest] = self.profiler.instrument('tools/call', _call_tool)
 
         return app
 
     async def run_stdio_proxy(self, server: Server):
-        async with stdio_server() as (read_stream, write_stream):
+        stdout = anyio.wrap_file(TextIOWrapper(self.protocol_stdout.buffer, encoding='utf-8'))
+        async with stdio_server(stdout=stdout) as (read_stream, write_stream):
             await server.run(
                 read_stream,
                 write_stream,
                 server.create_initialization_options()
             )
-        await self.close()
 
-    async def run_sse_streamable_http_proxy(self, mcp_server: Server, debug: bool):
+    async def run_sse_streamable_http_proxy(
+            self,
+            mcp_server: Server,
+            debug: bool,
+            transports=('sse', 'streamable-http'),
+            host: str = '127.0.0.1',
+            port: int = 8082,
+    ):
+        frontend_conf = self.conf.get('frontend', {})
+        sse_conf = frontend_conf.get('sse', {})
+        streamable_http_conf = frontend_conf.get('streamable-http', {})
         http_session_manager = StreamableHTTPSessionManager(
             app=mcp_server,
             event_store=None,
             json_response=True,
             stateless=False,
         )
-        sse_transport = SseServerTransport("/messages/")
+        sse_transport = SseServerTransport(sse_conf.get('message_path', '/messages/'))
 
         async def handle_streamable_http_instance(scope: Scope, receive: Receive, send: Send) -> None:
             print(f'in handle_streamable_http_instance, scope={scope}, receive={receive}, send={send}')
@@ -199,6 +265,9 @@ class MCPProxy:
         @contextlib.asynccontextmanager
         async def lifespan(app: Starlette) -> AsyncIterator[None]:
             """Context manager for managing session manager lifecycle."""
+            if 'streamable-http' not in transports:
+                yield
+                return
             async with http_session_manager.run():
                 print("Application started with StreamableHTTP session manager!")
                 try:
@@ -206,24 +275,55 @@ class MCPProxy:
                 finally:
                     print("Application shutting down...")
 
+        routes = self.profiler.admin_routes() + self.payload_budget.routes()
+        if 'streamable-http' in transports:
+            routes.append(Mount(streamable_http_conf.get('path', '/mcp'),
+                                app=self.batch_app(handle_streamable_http_instance, group_by_upstream=True)))
+        if 'sse' in transports:
+            routes.append(Route(sse_conf.get('path', '/sse'), endpoint=handle_sse_instance))
+            routes.append(Mount(sse_conf.get('message_path', '/messages/'),
+                                app=self.batch_app(sse_transport.handle_post_message, group_by_upstream=False)))
+
         starlette_app = Starlette(
             debug=debug,
-            routes=[
-                Mount("/mcp", app=handle_streamable_http_instance),
-                Route("/sse", endpoint=handle_sse_instance),
-                Mount("/messages/", app=sse_transport.handle_post_message),
-            ],
+            routes=routes,
             lifespan=lifespan
         )
 
         config = uvicorn.Config(
-            starlette_app,
-            port=8082,
+            self.profiler.asgi(starlette_app),
+            host=host,
+            port=port,
         )
 
         http_server = uvicorn.Server(config)
         await http_server.serve()
 
+    def batch_app(self, app, group_by_upstream: bool) -> JSONRPCBatchApp:
+        batch_conf = self.conf.get('batch', {})
+        return JSONRPCBatchApp(
+            app,
+            route_key=self.batch_route_key if group_by_upstream else None,
+            max_batch_size=batch_conf.get('max_size', 32),
+            upstream_concurrency=batch_conf.get('upstream_concurrency', 8),
+            stream=batch_conf.get('stream', False),
+        )
+
+    def batch_route_key(self, message: dict) -> str:
+        """Name of the upstream a JSON-RPC message is bound for, '' for aggregated requests."""
+        params = message.get('params') or {}
+        method = message.get('method')
+        if method in ('tools/call', 'prompts/get'):
+            target = params.get('name', '')
+        elif method == 'resources/read':
+            target = params.get('uri', '')
+        else:
+            return ''
+        parsed_key = self.parse_server_key(str(target))
+        if len(parsed_key) != 2 or parsed_key[0] not in self.server:
+            return ''
+        return parsed_key[0]
+
     @staticmethod
     def gen_server_key(server_name, v):
         return f'{server_name}/{v}'
@@ -236,7 +336,8 @@ class MCPProxy:
         all_prompts = []
         for name, server in self.server.items():
             if server['proxy'].session:
-                prompts_res = await server['proxy'].session.list_prompts()
+                with self.profiler.phase('upstream'):
+                    prompts_res = await server['proxy'].session.list_prompts()
                 prompts = prompts_res.prompts
                 for prompt in prompts:
                     prompt.name = self.gen_server_key(name, prompt.name)
@@ -251,13 +352,15 @@ class MCPProxy:
             print(f'in self get_prompt invalid')
         server_name, name = parsed_key
         server = self.server[server_name]['proxy'].session
-        return await server.get_prompt(name, arguments=arguments)
+        with self.profiler.phase('upstream'):
+            return await server.get_prompt(name, arguments=arguments)
 
     async def list_resources(self, cursor: str | None = None) -> types.ListResourcesResult:
         all_resources = []
         for name, server in self.server.items():
             if server['proxy']:
-                resources_res = await server['proxy'].session.list_resources()
+                with self.profiler.phase('upstream'):
+                    resources_res = await server['proxy'].session.list_resources()
                 resources = resources_res.resources
                 for resource in resources:
                     resource.uri = self.gen_server_key(name, resource.uri)
@@ -270,7 +373,8 @@ class MCPProxy:
         all_resourceTemplates = []
         for name, server in self.server.items():
             if server['proxy']:
-                resources_res = await server['proxy'].session.list_resource_templates()
+                with self.profiler.phase('upstream'):
+                    resources_res = await server['proxy'].session.list_resource_templates()
                 resources = resources_res.resourceTemplates
                 for resource in resources:
                     resource.uriTemplate = self.gen_server_key(name, resource.uriTemplate)
@@ -279,19 +383,26 @@ class MCPProxy:
         res = types.ListResourceTemplatesResult(resourceTemplates=all_resourceTemplates)
         return res
 
-    async def read_resource(self, uri: AnyUrl) -> types.ReadResourceResult:
+    async def read_resource(
+            self,
+            uri: AnyUrl,
+            reservation: PayloadReservation | None = None,
+    ) -> types.ReadResourceResult:
         parsed_key = self.parse_server_key(uri.scheme)
         if len(parsed_key) != 2 or parsed_key[0] not in self.server or not self.server[parsed_key[0]]['proxy']:
             return types.ReadResourceResult()
         server_name, uri = parsed_key
         server = self.server[server_name]['proxy'].session
-        return await server.read_resource(AnyUrl(uri))
+        with self.profiler.phase('upstream'):
+            result = await server.read_resource(AnyUrl(uri))
+        return await self.payload_budget.track(result, reservation)
 
     async def list_tools(self, cursor: str | None = None) -> types.ListToolsResult:
         all_tools = []
         for name, server in self.server.items():
             if server['proxy']:
-                tools_res = await server['proxy'].session.list_tools()
+                with self.profiler.phase('upstream'):
+                    tools_res = await server['proxy'].session.list_tools()
                 tools = tools_res.tools
                 for tool in tools:
                     tool.name = self.gen_server_key(name, tool.name)
@@ -305,10 +416,13 @@ class MCPProxy:
             arguments: dict[str, Any] | None = None,
             read_timeout_seconds: timedelta | None = None,
             progress_callback: ProgressFnT | None = None,
+            reservation: PayloadReservation | None = None,
     ) -> types.CallToolResult:
         parsed_key = self.parse_server_key(name)
         if len(parsed_key) != 2 or parsed_key[0] not in self.server or not self.server[parsed_key[0]]['proxy']:
             return types.CallToolResult()
         server_name, name = parsed_key
         server = self.server[server_name]['proxy'].session
-        return await server.call_tool(name, arguments=arguments)
+        with self.profiler.phase('upstream'):
+            result = await server.call_tool(name, arguments=arguments)
+        return await self.payload_budget.track(result, reservation)
@@ -0,0 +1,336 @@
+import asyncio
+import base64
+import collections
+import contextlib
+import json
+import os
+import secrets
+import sys
+import tempfile
+import time
+import weakref
+from collections.abc import AsyncIterator
+
+import mcp.types as types
+
+from server_result import HookedServerResult
+
+MB = 1024 * 1024
+
+
+class PayloadBudgetError(Exception):
+    pass
+
+
+class PayloadReservation:
+    """Bytes of the global budget held by one read_resource/call_tool request."""
+
+    def __init__(self, budget: 'PayloadBudget', size: int):
+        self.budget = budget
+        self.size = size
+        self.released = False
+        self.handed_over = False
+
+    def resize(self, size: int):
+        if self.released:
+            return
+        self.budget.gauges['bytes_in_flight'] += size - self.size
+        shrunk = size < self.size
+        self.size = size
+        if shrunk:
+            self.budget._wake()
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        self.budget.gauges['bytes_in_flight'] -= self.size
+        self.budget._wake()
+
+    def release_after_dump(self, response: types.ServerResult) -> types.ServerResult:
+        """Hand the reservation over to a handler's response, it is released once the SDK has dumped it."""
+        if not self.budget.enabled:
+            return response
+        response = HookedServerResult.wrap(response).on_dumped(lambda elapsed: self.release())
+        self.handed_over = True
+        # a response that is never sent still gives its bytes back when it is freed
+        weakref.finalize(response, self.budget._release_threadsafe, asyncio.get_running_loop(), self)
+        return response
+
+
+class PayloadBudget:
+    """Memory budget for resource and tool payloads, configured by the `payload` section of the conf.
+
+    Every read_resource/call_tool request reserves `request_estimate_mb` of
+    the global budget before it goes upstream, waiting in line while the
+    budget is full, so at most about global/estimate payload requests are
+    outstanding at once. Once the result arrives the reservation is settled
+    to its real size and held until the SDK has dumped the response.
+
+    When an HTTP frontend is running, payload items above the spill
+    threshold are written to a temporary file and the client gets a link
+    to /payloads/<token> instead, which streams the file in chunks. Items a
+    tool repeats in structuredContent stay inline, since structured content
+    has to match the tool's outputSchema and cannot become a link. The
+    result has to be fully received and validated by the client session
+    before it can be measured, so spilling and `request_limit_mb` shorten
+    how long a large payload is held; they do not lower the peak of a
+    single request. The peak across requests is bounded by the reservations.
+    """
+
+    def __init__(self, conf: dict):
+        self.enabled = conf.get('enabled', False)
+        self.request_limit = conf.get('request_limit_mb', 64) * MB
+        self.request_estimate = int(conf.get('request_estimate_mb', 1) * MB)
+        self.global_limit = conf.get('global_limit_mb', 512) * MB
+        self.spill_threshold = conf.get('spill_threshold_mb', 4) * MB
+        self.spill_dir = conf.get('spill_dir') or None
+        self.spill_ttl = conf.get('spill_ttl', 300)
+        self.chunk_size = conf.get('chunk_size_kb', 64) * 1024
+        self.admission_timeout = conf.get('admission_timeout', 30)
+        self.spill_url = conf.get('spill_url')
+        self.gauges = {
+            'bytes_in_flight': 0,
+            'bytes_spilled': 0,
+            'files_spilled': 0,
+            'requests_waiting': 0,
+            'requests_rejected': 0,
+        }
+        self._waiters = collections.deque()
+        self._spilled = {}
+
+    @contextlib.asynccontextmanager
+    async def reserve(self) -> AsyncIterator[PayloadReservation]:
+        """Reserve budget for one request, released when the block exits.
+
+        Passing the handler's response to `release_after_dump` hands the
+        reservation over to it, then it is released once the SDK has dumped
+        the response, unless the block fails.
+        """
+        size = self.request_estimate if self.enabled else 0
+        if self.enabled:
+            await self._acquire(size)
+        reservation = PayloadReservation(self, size)
+        try:
+            yield reservation
+        except BaseException:
+            reservation.release()
+            raise
+        if not reservation.handed_over:
+            reservation.release()
+
+    async def _acquire(self, size: int):
+        if not self._waiters and self._fits(size):
+            self.gauges['bytes_in_flight'] += size
+            return
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append((waiter, size))
+        self.gauges['requests_waiting'] += 1
+        try:
+            await asyncio.wait([waiter], timeout=self.admission_timeout)
+        except BaseException:
+            self._abandon(waiter, size)
+            raise
+        finally:
+            self.gauges['requests_waiting'] -= 1
+        if not waiter.done():
+            self._abandon(waiter, size)
+            self.gauges['requests_rejected'] += 1
+            raise PayloadBudgetError(f'payload budget exhausted, {self.gauges["bytes_in_flight"]} bytes in flight')
+
+    def _abandon(self, waiter: asyncio.Future, size: int):
+        if waiter.done() and not waiter.cancelled():
+            # granted right before we gave up, hand the bytes back
+            self.gauges['bytes_in_flight'] -= size
+        else:
+            waiter.cancel()
+        try:
+            self._waiters.remove((waiter, size))
+        except ValueError:
+            pass
+        self._wake()
+
+    def _fits(self, size: int) -> bool:
+        # a request larger than the whole budget still runs, alone
+        in_flight = self.gauges['bytes_in_flight']
+        return in_flight + size <= self.global_limit or in_flight == 0
+
+    def _wake(self):
+        """Grant waiters in order, as far as the free budget allows."""
+        while self._waiters:
+            waiter, size = self._waiters[0]
+            if waiter.done():
+                self._waiters.popleft()
+                continue
+            if not self._fits(size):
+                return
+            self._waiters.popleft()
+            self.gauges['bytes_in_flight'] += size
+            waiter.set_result(None)
+
+    async def track(self, result, reservation: PayloadReservation | None):
+        """Settle the reservation to the size of a ReadResourceResult or CallToolResult, spilling large items."""
+        if not self.enabled or reservation is None:
+            return result
+        if isinstance(result, types.ReadResourceResult):
+            items = result.contents
+            structured_size = 0
+        else:
+            items = result.content
+            structured_size = self.structured_size(result.structuredContent)
+        size = sum(self.item_size(item) for item in items) + structured_size
+        # the payload is already in memory, count it while it is spilled or rejected
+        reservation.resize(size)
+        if size > self.request_limit:
+            self.gauges['requests_rejected'] += 1
+            raise PayloadBudgetError(f'payload of {size} bytes exceeds the per-request limit {self.request_limit}')
+
+        if self.spill_url:
+            self._expire_spilled()
+            structured = None if isinstance(result, types.ReadResourceResult) else result.structuredContent
+            for i, item in enumerate(items):
+                if self.item_size(item) < self.spill_threshold:
+                    continue
+                # structuredContent has to match the tool's outputSchema so it is never
+                # replaced by a link, spilling an item it repeats would not shrink the response
+                if structured is not None and await asyncio.to_thread(self._repeats, structured, item):
+                    continue
+                items[i] = await self.spill(item)
+            reservation.resize(sum(self.item_size(item) for item in items) + structured_size)
+
+        return result
+
+    @classmethod
+    def structured_size(cls, value) -> int:
+        """Rough in-memory size of JSON-like structured content."""
+        if isinstance(value, str):
+            return len(value)
+        if isinstance(value, dict):
+            return sum(len(str(k)) + cls.structured_size(v) for k, v in value.items())
+        if isinstance(value, (list, tuple)):
+            return sum(cls.structured_size(v) for v in value)
+        return 0 if value is None else 8
+
+    @staticmethod
+    def item_value(item) -> str | None:
+        if isinstance(item, types.EmbeddedResource):
+            item = item.resource
+        for field in ('blob', 'data', 'text'):
+            value = getattr(item, field, None)
+            if isinstance(value, str):
+                return value
+        return None
+
+    @classmethod
+    def item_size(cls, item) -> int:
+        value = cls.item_value(item)
+        return 0 if value is None else len(value)
+
+    @classmethod
+    def _repeats(cls, structured, item) -> bool:
+        """Whether a content item is a string held in structured content or its JSON text, as FastMCP emits."""
+        if cls._holds_string(structured, cls.item_value(item)):
+            return True
+        if not isinstance(item, types.TextContent) or item.text.lstrip()[:1] not in ('{', '['):
+            return False
+        try:
+            return json.loads(item.text) == structured
+        except ValueError:
+            return False
+
+    @classmethod
+    def _holds_string(cls, structured, value: str) -> bool:
+        if isinstance(structured, str):
+            return structured == value
+        if isinstance(structured, dict):
+            return any(cls._holds_string(v, value) for v in structured.values())
+        if isinstance(structured, (list, tuple)):
+            return any(cls._holds_string(v, value) for v in structured)
+        return False
+
+    async def spill(self, item):
+        resource = item.resource if isinstance(item, types.EmbeddedResource) else item
+        mime_type = getattr(resource, 'mimeType', None) or 'application/octet-stream'
+        path, size = await asyncio.to_thread(self._write_spill_file, resource)
+        token = secrets.token_urlsafe(16)
+        self._spilled[token] = (path, mime_type, size, time.monotonic() + self.spill_ttl)
+        self.gauges['bytes_spilled'] += size
+        self.gauges['files_spilled'] += 1
+        url = f'{self.spill_url.rstrip("/")}/{token}'
+        print(f'spilled payload of {size} bytes to {path}, url={url}', file=sys.stderr)
+
+        if isinstance(item, (types.TextResourceContents, types.BlobResourceContents)):
+            return types.TextResourceContents(uri=item.uri, mimeType='text/uri-list', text=url)
+        name = str(getattr(resource, 'uri', '')) or token
+        return types.ResourceLink(type='resource_link', name=name, uri=url, mimeType=mime_type, size=size)
+
+    def _write_spill_file(self, resource) -> tuple[str, int]:
+        encoded = getattr(resource, 'blob', None) or getattr(resource, 'data', None)
+        step = self.chunk_size - self.chunk_size % 4
+        size = 0
+        with tempfile.NamedTemporaryFile(prefix='mcp_proxy_', dir=self.spill_dir, delete=False) as f:
+            if encoded is not None:
+                # base64 decodes independently on 4-character boundaries
+                for i in range(0, len(encoded), step):
+                    size += f.write(base64.b64decode(encoded[i:i + step]))
+            else:
+                for i in range(0, len(resource.text), self.chunk_size):
+                    size += f.write(resource.text[i:i + self.chunk_size].encode())
+        return f.name, size
+
+    def _expire_spilled(self):
+        now = time.monotonic()
+        for token, (_, _, _, expires) in list(self._spilled.items()):
+            if expires <= now:
+                self._remove_spilled(token)
+
+    def _remove_spilled(self, token: str):
+        path, _, size, _ = self._spilled.pop(token)
+        self.gauges['bytes_spilled'] -= size
+        self.gauges['files_spilled'] -= 1
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def cleanup(self):
+        for token in list(self._spilled):
+            self._remove_spilled(token)
+
+    @staticmethod
+    def _release_threadsafe(loop: asyncio.AbstractEventLoop, reservation: PayloadReservation):
+        try:
+            loop.call_soon_threadsafe(reservation.release)
+        except RuntimeError:
+            # loop already closed on shutdown
+            pass
+
+    def routes(self) -> list:
+        if not self.enabled:
+            return []
+        from starlette.requests import Request
+        from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+        from starlette.routing import Route
+
+        async def handle_payload(request: Request):
+            self._expire_spilled()
+            entry = self._spilled.get(request.path_params['token'])
+            if entry is None:
+                return PlainTextResponse('payload not found or expired', status_code=404)
+            path, mime_type, size, _ = entry
+
+            async def chunks():
+                with open(path, 'rb') as f:
+                    while chunk := await asyncio.to_thread(f.read, self.chunk_size):
+                        yield chunk
+
+            return StreamingResponse(chunks(), media_type=mime_type, headers={'content-length': str(size)})
+
+        async def handle_gauges(request: Request) -> JSONResponse:
+            return JSONResponse(self.gauges)
+
+        return [
+            Route('/payloads/{token}', endpoint=handle_payload),
+            Route('/admin/payloads', endpoint=handle_gauges),
+        ]
@@ -0,0 +1,240 @@
+import asyncio
+import contextlib
+import contextvars
+import cProfile
+import heapq
+import io
+import itertools
+import pstats
+import signal
+import sys
+import time
+from collections import defaultdict
+from collections.abc import AsyncIterator
+
+import mcp.types as types
+from mcp.server.lowlevel.server import request_ctx
+
+from server_result import HookedServerResult
+
+ARRIVAL_KEY = 'mcp_proxy_arrival'
+
+_current_timing = contextvars.ContextVar('mcp_proxy_current_timing', default=None)
+
+
+class RequestTiming:
+    """Per-request timing breakdown, phases are exclusive of nested phases.
+
+    `upstream` includes validating the upstream response in the client
+    session; `serialization` is the dump of the result the SDK does when it
+    sends the response, after the handler returned.
+    """
+
+    def __init__(self, method: str, queue: float = 0.0):
+        self.method = method
+        self.started_at = time.time()
+        self.phases = defaultdict(float)
+        self.phases['queue'] = queue
+        self.total = 0.0
+        self.nested = []
+
+    def to_dict(self) -> dict:
+        handler = self.total - self.phases['queue']
+        other = handler - sum(v for k, v in self.phases.items() if k != 'queue')
+        return {
+            'method': self.method,
+            'started_at': self.started_at,
+            'total_ms': round(self.total * 1000, 3),
+            'phases_ms': {k: round(v * 1000, 3) for k, v in {**self.phases, 'other': max(other, 0.0)}.items()},
+        }
+
+
+class Profiler:
+    """Opt-in profiling for the proxy, configured by the `profiling` section of the conf.
+
+    Provides an event loop lag monitor, per-request timing breakdowns with
+    the slowest N kept around, and on-demand cProfile samples triggered from
+    the /admin HTTP routes or SIGUSR1.
+    """
+
+    def __init__(self, conf: dict):
+        self.enabled = conf.get('enabled', False)
+        self.slow_requests = conf.get('slow_requests', 20)
+        self.loop_lag_interval = conf.get('loop_lag_interval', 0.5)
+        self.loop_lag_warn = conf.get('loop_lag_warn', 0.1)
+        self.profile_seconds = conf.get('profile_seconds', 10)
+        self.max_profile_seconds = conf.get('max_profile_seconds', 60)
+        self.profile_path = conf.get('profile_path', 'mcp_proxy_profile.txt')
+        self.loop_lag = {'last_ms': 0.0, 'max_ms': 0.0, 'samples': 0, 'stalls': 0}
+        self._slowest = []
+        self._seq = itertools.count()
+        self._sampling = False
+        self._signal_tasks = set()
+
+    def instrument(self, method: str, handler):
+        """Wrap a request handler so every call records a RequestTiming."""
+        if not self.enabled:
+            return handler
+
+        async def timed_handler(req):
+            start = time.perf_counter()
+            timing = RequestTiming(method, self._queue_time(start))
+            token = _current_timing.set(timing)
+            response = None
+            try:
+                response = await handler(req)
+                if isinstance(response, types.ServerResult):
+                    # the SDK dumps the result after we return, time it and record the request there
+                    response = HookedServerResult.wrap(response).on_dumped(
+                        lambda elapsed: self._record_serialized(timing, elapsed))
+                return response
+            finally:
+                _current_timing.reset(token)
+                timing.total = time.perf_counter() - start + timing.phases['queue']
+                if not isinstance(response, HookedServerResult):
+                    self._record(timing)
+
+        return timed_handler
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        timing = _current_timing.get()
+        if timing is None:
+            yield
+            return
+        start = time.perf_counter()
+        timing.nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            timing.phases[name] += elapsed - timing.nested.pop()
+            if timing.nested:
+                timing.nested[-1] += elapsed
+
+    def asgi(self, app):
+        """Stamp the arrival time of HTTP requests so handlers can report queueing."""
+        if not self.enabled:
+            return app
+
+        async def stamped_app(scope, receive, send):
+            if scope['type'] == 'http':
+                scope.setdefault('state', {})[ARRIVAL_KEY] = time.perf_counter()
+            await app(scope, receive, send)
+
+        return stamped_app
+
+    def slowest(self) -> list[dict]:
+        timings = [timing for _, _, timing in self._slowest]
+        return [timing.to_dict() for timing in sorted(timings, key=lambda timing: timing.total, reverse=True)]
+
+    def report(self) -> dict:
+        return {'loop_lag': dict(self.loop_lag), 'slowest_requests': self.slowest()}
+
+    @contextlib.asynccontextmanager
+    async def run(self) -> AsyncIterator[None]:
+        """Run the loop lag monitor and the SIGUSR1 handler for the lifetime of the proxy."""
+        if not self.enabled:
+            yield
+            return
+        loop = asyncio.get_running_loop()
+        monitor = loop.create_task(self.monitor_loop_lag())
+        signal_installed = False
+        if hasattr(signal, 'SIGUSR1'):
+            try:
+                loop.add_signal_handler(signal.SIGUSR1, self._on_profile_signal)
+                signal_installed = True
+            except (NotImplementedError, RuntimeError):
+                pass
+        try:
+            yield
+        finally:
+            if signal_installed:
+                loop.remove_signal_handler(signal.SIGUSR1)
+            monitor.cancel()
+
+    async def monitor_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.loop_lag_interval)
+            lag = max(loop.time() - start - self.loop_lag_interval, 0.0)
+            self.loop_lag['last_ms'] = round(lag * 1000, 3)
+            self.loop_lag['max_ms'] = max(self.loop_lag['max_ms'], self.loop_lag['last_ms'])
+            self.loop_lag['samples'] += 1
+            if lag > self.loop_lag_warn:
+                self.loop_lag['stalls'] += 1
+                print(f'event loop stalled for {lag * 1000:.1f}ms', file=sys.stderr)
+
+    async def sample_profile(self, seconds: float | None = None) -> str:
+        """Profile everything the event loop runs for `seconds`, write and return the stats."""
+        if self._sampling:
+            return 'a profile is already running'
+        seconds = min(seconds or self.profile_seconds, self.max_profile_seconds)
+        self._sampling = True
+        profile = cProfile.Profile()
+        print(f'profiling the event loop for {seconds}s', file=sys.stderr)
+        try:
+            profile.enable()
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+            self._sampling = False
+
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(50)
+        with open(self.profile_path, 'w') as f:
+            f.write(out.getvalue())
+        print(f'profile written to {self.profile_path}', file=sys.stderr)
+        return out.getvalue()
+
+    def admin_routes(self) -> list:
+        if not self.enabled:
+            return []
+        from starlette.requests import Request
+        from starlette.responses import JSONResponse, PlainTextResponse
+        from starlette.routing import Route
+
+        async def handle_slow(request: Request) -> JSONResponse:
+            return JSONResponse(self.report())
+
+        async def handle_profile(request: Request) -> PlainTextResponse:
+            try:
+                seconds = float(request.query_params.get('seconds', self.profile_seconds))
+            except ValueError:
+                return PlainTextResponse('invalid seconds', status_code=400)
+            if not 0 < seconds <= self.max_profile_seconds:
+                return PlainTextResponse(f'seconds must be in (0, {self.max_profile_seconds}]', status_code=400)
+            return PlainTextResponse(await self.sample_profile(seconds))
+
+        return [
+            Route('/admin/slow', endpoint=handle_slow),
+            Route('/admin/profile', endpoint=handle_profile),
+        ]
+
+    def _queue_time(self, now: float) -> float:
+        try:
+            request = request_ctx.get().request
+            arrival = request.scope.get('state', {}).get(ARRIVAL_KEY) if request is not None else None
+        except (LookupError, AttributeError):
+            return 0.0
+        return max(now - arrival, 0.0) if arrival is not None else 0.0
+
+    def _on_profile_signal(self):
+        task = asyncio.get_running_loop().create_task(self.sample_profile())
+        self._signal_tasks.add(task)
+        task.add_done_callback(self._signal_tasks.discard)
+
+    def _record_serialized(self, timing: RequestTiming, elapsed: float):
+        timing.phases['serialization'] += elapsed
+        timing.total += elapsed
+        self._record(timing)
+
+    def _record(self, timing: RequestTiming):
+        if self.slow_requests <= 0:
+            return
+        entry = (timing.total, next(self._seq), timing)
+        if len(self._slowest) < self.slow_requests:
+            heapq.heappush(self._slowest, entry)
+        elif entry[0] > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
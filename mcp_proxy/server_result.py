@@ -0,0 +1,34 @@
+import time
+from typing import Callable
+
+import mcp.types as types
+from pydantic import PrivateAttr
+
+
+class HookedServerResult(types.ServerResult):
+    """ServerResult that runs callbacks once the SDK has dumped it to send the response.
+
+    The SDK dumps the result in the handler's task right after the handler
+    returned, so this is where the response is done with it. Every callback
+    gets the seconds the dump took.
+    """
+
+    _on_dumped: list[Callable[[float], None]] = PrivateAttr(default_factory=list)
+
+    @classmethod
+    def wrap(cls, result: types.ServerResult) -> 'HookedServerResult':
+        return result if isinstance(result, cls) else cls(result.root)
+
+    def on_dumped(self, callback: Callable[[float], None]) -> 'HookedServerResult':
+        self._on_dumped.append(callback)
+        return self
+
+    def model_dump(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().model_dump(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            callbacks, self._on_dumped = self._on_dumped, []
+            for callback in callbacks:
+                callback(elapsed)
@@ -5,10 +5,11 @@ from typing import Optional
 
 class SSEProxy:
     session: Optional[ClientSession]
+    initialize_result: Optional[types.InitializeResult]
 
     async def connect(self, url, stack):
         streams = await stack.enter_async_context(sse_client(url))
         session = await stack.enter_async_context(ClientSession(*streams))
-        await session.initialize()
+        self.initialize_result = await session.initialize()
         self.session = session
         return session
@@ -1,14 +1,16 @@
 from mcp import ClientSession
+from mcp.types import InitializeResult
 from mcp.client.streamable_http import streamablehttp_client
 from typing import Optional
 
 
 class StreamableHttpProxy:
     session: Optional[ClientSession]
+    initialize_result: Optional[InitializeResult]
 
     async def connect(self, url, stack):
         _read, _write, _ = await stack.enter_async_context(streamablehttp_client(url))
         session = await stack.enter_async_context(ClientSession(_read, _write))
-        await session.initialize()
+        self.initialize_result = await session.initialize()
         self.session = session
         return session
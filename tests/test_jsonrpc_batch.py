@@ -0,0 +1,121 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip('starlette')
+
+from jsonrpc_batch import JSONRPCBatchApp, INVALID_REQUEST  # noqa: E402
+
+
+class FakeMCPApp:
+    """Answers every request inline after `params.delay` seconds, notifications with 202."""
+
+    def __init__(self):
+        self.running = {}
+        self.max_running = {}
+
+    async def __call__(self, scope, receive, send):
+        message = json.loads((await receive())['body'])
+        key = (message.get('params') or {}).get('upstream', '')
+        self.running[key] = self.running.get(key, 0) + 1
+        self.max_running[key] = max(self.max_running.get(key, 0), self.running[key])
+        try:
+            await asyncio.sleep((message.get('params') or {}).get('delay', 0))
+        finally:
+            self.running[key] -= 1
+        if 'id' not in message:
+            await send({'type': 'http.response.start', 'status': 202, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        body = json.dumps({'jsonrpc': '2.0', 'id': message['id'], 'result': {'method': message['method']}}).encode()
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'application/json'), (b'mcp-session-id', b'abc')]})
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def request(message_id, delay=0, upstream=''):
+    return {'jsonrpc': '2.0', 'id': message_id, 'method': 'tools/call',
+            'params': {'delay': delay, 'upstream': upstream}}
+
+
+def post(app, payload, accept=b'application/json'):
+    body = json.dumps(payload).encode()
+    scope = {'type': 'http', 'method': 'POST', 'path': '/mcp', 'headers': [(b'accept', accept)]}
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    status = sent[0]['status']
+    headers = dict(sent[0]['headers'])
+    return status, headers, b''.join(m.get('body', b'') for m in sent[1:])
+
+
+def test_single_message_passes_through():
+    status, _, body = post(JSONRPCBatchApp(FakeMCPApp()), request(1))
+    assert status == 200
+    assert json.loads(body)['id'] == 1
+
+
+def test_batch_responses_keep_request_order():
+    app = JSONRPCBatchApp(FakeMCPApp())
+    status, headers, body = post(app, [request(1, delay=0.05), request(2), request(3, delay=0.02)])
+    assert status == 200
+    assert headers[b'mcp-session-id'] == b'abc'
+    assert [r['id'] for r in json.loads(body)] == [1, 2, 3]
+
+
+def test_batch_size_limit():
+    status, _, body = post(JSONRPCBatchApp(FakeMCPApp(), max_batch_size=2), [request(1), request(2), request(3)])
+    assert status == 400
+    assert json.loads(body)['error']['code'] == INVALID_REQUEST
+
+
+def test_empty_batch_is_invalid():
+    status, _, body = post(JSONRPCBatchApp(FakeMCPApp()), [])
+    assert status == 400
+    assert json.loads(body)['error']['code'] == INVALID_REQUEST
+
+
+def test_notification_only_batch_is_accepted():
+    notification = {'jsonrpc': '2.0', 'method': 'notifications/initialized'}
+    status, _, body = post(JSONRPCBatchApp(FakeMCPApp()), [notification, notification])
+    assert status == 202
+    assert body == b''
+
+
+def test_invalid_elements_get_errors():
+    status, _, body = post(JSONRPCBatchApp(FakeMCPApp()), [5, {'id': 7}, {'jsonrpc': '2.0', 'id': 8, 'method': 3},
+                                                          request(9)])
+    responses = json.loads(body)
+    assert status == 200
+    assert [(r['id'], r.get('error', {}).get('code')) for r in responses] == [
+        (None, INVALID_REQUEST), (7, INVALID_REQUEST), (8, INVALID_REQUEST), (9, None)]
+
+
+def test_responses_to_server_requests_are_forwarded():
+    response = {'jsonrpc': '2.0', 'id': 'srv-1', 'result': {}}
+    status, _, _ = post(JSONRPCBatchApp(FakeMCPApp()), [response])
+    assert status == 202
+
+
+def test_same_upstream_calls_share_a_limit():
+    fake = FakeMCPApp()
+    app = JSONRPCBatchApp(fake, route_key=lambda m: m['params']['upstream'], upstream_concurrency=2)
+    post(app, [request(i, delay=0.02, upstream='a') for i in range(6)] +
+         [request(i, delay=0.02, upstream='b') for i in range(6, 9)])
+    assert fake.max_running == {'a': 2, 'b': 2}
+
+
+def test_streamed_responses_arrive_in_completion_order():
+    app = JSONRPCBatchApp(FakeMCPApp(), stream=True)
+    status, headers, body = post(app, [request(1, delay=0.05), request(2)], accept=b'application/json, text/event-stream')
+    assert status == 200
+    assert headers[b'content-type'] == b'text/event-stream'
+    events = [json.loads(line[5:]) for line in body.decode().splitlines() if line.startswith('data:')]
+    assert [e['id'] for e in events] == [2, 1]
@@ -0,0 +1,152 @@
+import asyncio
+import base64
+import json
+
+import pytest
+
+pytest.importorskip('mcp')
+
+import mcp.types as types  # noqa: E402
+
+from payload_budget import MB, PayloadBudget, PayloadBudgetError  # noqa: E402
+
+
+def text_result(size):
+    return types.CallToolResult(content=[types.TextContent(type='text', text='x' * size)])
+
+
+def test_reservations_limit_concurrent_requests():
+    budget = PayloadBudget({'enabled': True, 'global_limit_mb': 1, 'request_estimate_mb': 0.5,
+                            'admission_timeout': 5})
+    admitted = []
+
+    async def request(i, hold):
+        async with budget.reserve():
+            admitted.append(i)
+            await hold.wait()
+
+    async def main():
+        holds = [asyncio.Event() for _ in range(3)]
+        tasks = [asyncio.create_task(request(i, holds[i])) for i in range(3)]
+        await asyncio.sleep(0.01)
+        assert admitted == [0, 1]
+        assert budget.gauges['requests_waiting'] == 1
+        holds[0].set()
+        await asyncio.sleep(0.01)
+        assert admitted == [0, 1, 2]
+        for hold in holds:
+            hold.set()
+        await asyncio.gather(*tasks)
+        assert budget.gauges['bytes_in_flight'] == 0
+
+    asyncio.run(main())
+
+
+def test_admission_times_out():
+    budget = PayloadBudget({'enabled': True, 'global_limit_mb': 1, 'request_estimate_mb': 1,
+                            'admission_timeout': 0.05})
+
+    async def main():
+        async with budget.reserve():
+            with pytest.raises(PayloadBudgetError):
+                async with budget.reserve():
+                    pass
+        assert budget.gauges['requests_rejected'] == 1
+        assert budget.gauges['bytes_in_flight'] == 0
+        assert not budget._waiters
+
+    asyncio.run(main())
+
+
+def test_cancelled_request_releases_reservation():
+    budget = PayloadBudget({'enabled': True, 'global_limit_mb': 1, 'request_estimate_mb': 1})
+
+    async def main():
+        async def slow_upstream():
+            async with budget.reserve():
+                await asyncio.sleep(10)
+
+        task = asyncio.create_task(slow_upstream())
+        await asyncio.sleep(0.01)
+        assert budget.gauges['bytes_in_flight'] == MB
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert budget.gauges['bytes_in_flight'] == 0
+
+    asyncio.run(main())
+
+
+def test_reservation_is_released_once_the_response_is_dumped():
+    budget = PayloadBudget({'enabled': True})
+
+    async def main():
+        async with budget.reserve() as reservation:
+            result = await budget.track(text_result(1000), reservation)
+            response = reservation.release_after_dump(types.ServerResult(result))
+        assert budget.gauges['bytes_in_flight'] == 1000
+        response.model_dump(by_alias=True, mode='json', exclude_none=True)
+        assert budget.gauges['bytes_in_flight'] == 0
+
+    asyncio.run(main())
+
+
+def test_structured_content_is_counted():
+    result = text_result(10)
+    result.structuredContent = {'items': ['y' * 500, 'z' * 500]}
+    budget = PayloadBudget({'enabled': True, 'request_limit_mb': 0.0005})
+
+    async def main():
+        with pytest.raises(PayloadBudgetError):
+            async with budget.reserve() as reservation:
+                await budget.track(result, reservation)
+        assert budget.gauges['bytes_in_flight'] == 0
+
+    asyncio.run(main())
+
+
+def test_large_items_are_spilled(tmp_path):
+    blob = base64.b64encode(b'y' * 300_000).decode()
+    result = types.ReadResourceResult(contents=[types.BlobResourceContents(uri='a://b', blob=blob)])
+    budget = PayloadBudget({'enabled': True, 'spill_threshold_mb': 0.1, 'spill_dir': str(tmp_path),
+                            'spill_url': 'http://127.0.0.1:8082/payloads/'})
+
+    async def main():
+        async with budget.reserve() as reservation:
+            tracked = await budget.track(result, reservation)
+            response = reservation.release_after_dump(types.ServerResult(tracked))
+        link = tracked.contents[0]
+        assert link.mimeType == 'text/uri-list'
+        assert link.text.startswith('http://127.0.0.1:8082/payloads/')
+        assert budget.gauges['bytes_spilled'] == 300_000
+        assert budget.gauges['bytes_in_flight'] == len(link.text)
+        response.model_dump()
+        budget.cleanup()
+        assert not list(tmp_path.iterdir())
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize('structured', [
+    {'result': 'x' * 300_000},
+    {'items': ['x' * 300_000]},
+])
+def test_items_repeated_in_structured_content_are_not_spilled(tmp_path, structured):
+    result = text_result(300_000)
+    result.structuredContent = structured
+    json_result = types.CallToolResult(content=[types.TextContent(type='text', text=json.dumps(structured))],
+                                       structuredContent=structured)
+    budget = PayloadBudget({'enabled': True, 'spill_threshold_mb': 0.1, 'spill_dir': str(tmp_path),
+                            'spill_url': 'http://127.0.0.1:8082/payloads/'})
+
+    async def main():
+        for expected in (result, json_result):
+            text = expected.content[0].text
+            async with budget.reserve() as reservation:
+                tracked = await budget.track(expected, reservation)
+            assert tracked.content[0].text == text
+            assert tracked.structuredContent == structured
+        assert budget.gauges['bytes_spilled'] == 0
+        assert not list(tmp_path.iterdir())
+
+    asyncio.run(main())
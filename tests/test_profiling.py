@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip('mcp')
+
+import mcp.types as types  # noqa: E402
+
+from profiling import Profiler  # noqa: E402
+
+
+def test_phases_exclude_nested_phases():
+    profiler = Profiler({'enabled': True})
+
+    async def handler(req):
+        with profiler.phase('aggregation'):
+            time.sleep(0.02)
+            with profiler.phase('upstream'):
+                time.sleep(0.05)
+        return None
+
+    asyncio.run(profiler.instrument('tools/list', handler)(None))
+    [timing] = profiler.slowest()
+    phases = timing['phases_ms']
+    assert 50 <= phases['upstream'] < 70
+    assert 20 <= phases['aggregation'] < 40
+    assert phases['aggregation'] + phases['upstream'] <= timing['total_ms']
+
+
+def test_serialization_is_recorded_once_the_result_is_dumped():
+    profiler = Profiler({'enabled': True})
+
+    async def handler(req):
+        return types.ServerResult(types.CallToolResult(content=[types.TextContent(type='text', text='x')]))
+
+    response = asyncio.run(profiler.instrument('tools/call', handler)(None))
+    assert profiler.slowest() == []
+
+    response.model_dump(by_alias=True, mode='json', exclude_none=True)
+    [timing] = profiler.slowest()
+    assert timing['phases_ms']['serialization'] > 0
+    assert timing['total_ms'] >= timing['phases_ms']['serialization']
+
+
+def test_slowest_requests_are_ranked_with_serialization(monkeypatch):
+    profiler = Profiler({'enabled': True, 'slow_requests': 1})
+
+    async def handler(req):
+        return types.ServerResult(types.CallToolResult(content=[]))
+
+    async def main():
+        timed_handler = profiler.instrument('tools/call', handler)
+        return await timed_handler(None), await timed_handler(None)
+
+    first, second = asyncio.run(main())
+    original_dump = types.ServerResult.model_dump
+
+    def slow_dump(self, *args, **kwargs):
+        time.sleep(0.05)
+        return original_dump(self, *args, **kwargs)
+
+    first.model_dump()
+    monkeypatch.setattr(types.ServerResult, 'model_dump', slow_dump)
+    second.model_dump()
+    [timing] = profiler.slowest()
+    assert timing['phases_ms']['serialization'] >= 50